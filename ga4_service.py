@@ -3,6 +3,8 @@ from google.analytics.data_v1beta.types import RunReportRequest, DateRange, Dime
 from models import GA4QueryInput, BasicQueryInput
 from database import get_user_credentials
 from auth import always_refresh_user_tokens
+from utils import resolve_date_range, parse_metric_value
+from query_planner import build_cache_key, plan_rollup, remember_result
 import logging
 import traceback
 
@@ -63,6 +65,77 @@ def build_filter_expression(filters: dict) -> FilterExpression | None:
     # Handle simple key-value filters
     return parse_simple_filters(filters)
 
+def build_comparison_rows(response, range_names: list[str], truncated: bool = False) -> list[dict]:
+    """
+    Align a multi-date-range GA4 response by dimensions and compute deltas.
+
+    GA4 returns one row per dimension combination and date range, tagged with
+    an extra "dateRange" dimension. The first range is compared against each
+    of the others; a range with no row for a combination counts as 0, unless
+    the response was truncated by limit, in which case its deltas are None.
+    """
+    dim_names = [h.name for h in response.dimension_headers]
+    metric_names = [h.name for h in response.metric_headers]
+    range_index = dim_names.index("dateRange")
+
+    aligned = {}
+    for row in response.rows:
+        dim_values = [v.value for v in row.dimension_values]
+        key = tuple(v for i, v in enumerate(dim_values) if i != range_index)
+        if key not in aligned:
+            row_data = {name: value for i, (name, value) in enumerate(zip(dim_names, dim_values)) if i != range_index}
+            row_data["values"] = {name: None for name in range_names}
+            aligned[key] = row_data
+        aligned[key]["values"][dim_values[range_index]] = {
+            metric_names[i]: metric_value.value for i, metric_value in enumerate(row.metric_values)
+        }
+
+    base_name = range_names[0]
+    for row_data in aligned.values():
+        base_values = row_data["values"][base_name] or {}
+        deltas = {}
+        for other_name in range_names[1:]:
+            other_values = row_data["values"][other_name] or {}
+            deltas[other_name] = {}
+            # A missing row in a truncated response may just have been cut off
+            if truncated and (row_data["values"][base_name] is None or row_data["values"][other_name] is None):
+                deltas[other_name] = {metric_name: {"absolute": None, "percentage": None} for metric_name in metric_names}
+                continue
+            for metric_name in metric_names:
+                current = parse_metric_value(base_values.get(metric_name))
+                previous = parse_metric_value(other_values.get(metric_name))
+                absolute = current - previous
+                # Drop float noise (0.5 - 0.4 -> 0.09999999999999998) on ratio and revenue metrics
+                if isinstance(absolute, float):
+                    absolute = round(absolute, 10)
+                deltas[other_name][metric_name] = {
+                    "absolute": absolute,
+                    "percentage": round((current - previous) / previous * 100, 2) if previous else None
+                }
+        row_data["deltas"] = deltas
+
+    return list(aligned.values())
+
+def resolve_dimension_names(input: GA4QueryInput, is_comparison: bool = False) -> list[str]:
+    """
+    Get the dimensions to request, including the granularity dimension if needed
+    """
+    dimension_names = list(input.dimensions)
+    
+    # Handle granularity as a dimension if provided and not already in dimensions.
+    # Skipped for comparisons: dates differ between ranges, so rows would never align.
+    if input.granularity and input.granularity not in input.dimensions and not is_comparison:
+        granularity_map = {
+            "daily": "date",
+            "weekly": "week",
+            "monthly": "month"
+        }
+        gran_dim = granularity_map.get(input.granularity.lower(), input.granularity)
+        if gran_dim not in dimension_names:
+            dimension_names.append(gran_dim)
+    
+    return dimension_names
+
 async def get_ga4_data(input: GA4QueryInput) -> dict:
     """
     Query Google Analytics 4 data with specific dimensions and metrics.
@@ -88,6 +161,35 @@ async def get_ga4_data(input: GA4QueryInput) -> dict:
             property_id = input.property_id
             logger.info(f"Using override property ID: {property_id}")
         
+        # Validate inputs
+        if not input.dimensions and not input.metrics:
+            return {
+                "success": False,
+                "error": "At least one dimension or metric must be specified",
+                "data": [],
+                "rowCount": 0
+            }
+        
+        # Resolve date ranges (presets are relative to today)
+        try:
+            if input.date_ranges:
+                date_ranges = []
+                for named_range in input.date_ranges:
+                    start_date, end_date = resolve_date_range(named_range.preset, named_range.start_date, named_range.end_date)
+                    date_ranges.append(DateRange(start_date=start_date, end_date=end_date, name=named_range.name))
+            else:
+                start_date, end_date = resolve_date_range(start_date=input.start_date, end_date=input.end_date)
+                date_ranges = [DateRange(start_date=start_date, end_date=end_date)]
+        except ValueError as e:
+            logger.error(f"Failed to resolve date ranges: {str(e)}")
+            return {
+                "success": False,
+                "error": f"Invalid date range: {str(e)}",
+                "data": [],
+                "rowCount": 0
+            }
+        is_comparison = len(date_ranges) > 1
+        
         # Refresh tokens
         try:
             creds = always_refresh_user_tokens(refresh_token)
@@ -101,6 +203,36 @@ async def get_ga4_data(input: GA4QueryInput) -> dict:
                 "rowCount": 0
             }
         
+        # Answer roll-ups of an already-fetched result locally instead of calling GA4.
+        # Runs after the token refresh so revoked credentials never get cached data.
+        dimension_names = resolve_dimension_names(input, is_comparison)
+        cache_key = None
+        if not is_comparison:
+            cache_key = build_cache_key(
+                input.user_id,
+                property_id,
+                [(date_ranges[0].start_date, date_ranges[0].end_date)],
+                input.filters,
+                input.currency_code,
+                input.include_empty_rows
+            )
+            planned = plan_rollup(cache_key, dimension_names, input.metrics, input.order_by, input.limit)
+            if planned is not None:
+                rows = planned["rows"]
+                total_sessions = sum(parse_metric_value(r.get("sessions")) for r in rows)
+                return {
+                    "success": True,
+                    "servedLocally": True,
+                    "rolledUpFrom": planned["sourceDimensions"],
+                    "data": rows,
+                    "rowCount": len(rows),
+                    "totalSessions": total_sessions,
+                    "dimensions": input.dimensions,
+                    "metrics": input.metrics,
+                    "dateRange": f"{date_ranges[0].start_date} to {date_ranges[0].end_date}",
+                    "propertyId": property_id
+                }
+        
         # Create GA4 client
         try:
             client = BetaAnalyticsDataClient(credentials=creds)
@@ -114,29 +246,9 @@ async def get_ga4_data(input: GA4QueryInput) -> dict:
                 "rowCount": 0
             }
         
-        # Validate inputs
-        if not input.dimensions and not input.metrics:
-            return {
-                "success": False,
-                "error": "At least one dimension or metric must be specified",
-                "data": [],
-                "rowCount": 0
-            }
-        
         # Build the request
         try:
-            dimensions = [Dimension(name=d) for d in input.dimensions]
-            
-            # Handle granularity as a dimension if provided and not already in dimensions
-            if input.granularity and input.granularity not in input.dimensions:
-                granularity_map = {
-                    "daily": "date",
-                    "weekly": "week",
-                    "monthly": "month"
-                }
-                gran_dim = granularity_map.get(input.granularity.lower(), input.granularity)
-                if gran_dim not in [d.name for d in dimensions]:
-                    dimensions.append(Dimension(name=gran_dim))
+            dimensions = [Dimension(name=d) for d in dimension_names]
 
             # Build filters properly
             dimension_filter = None
@@ -174,7 +286,7 @@ async def get_ga4_data(input: GA4QueryInput) -> dict:
                 property=f"properties/{property_id}",
                 dimensions=dimensions,
                 metrics=[Metric(name=m) for m in input.metrics],
-                date_ranges=[DateRange(start_date=input.start_date, end_date=input.end_date)],
+                date_ranges=date_ranges,
                 limit=input.limit,
                 currency_code=input.currency_code if input.currency_code else None,
                 keep_empty_rows=input.include_empty_rows if input.include_empty_rows is not None else None,
@@ -211,6 +323,33 @@ async def get_ga4_data(input: GA4QueryInput) -> dict:
         
         # Convert response to readable format
         try:
+            if is_comparison:
+                # limit applies to the combined rows of all ranges, so a range can be cut off
+                truncated = len(response.rows) < response.row_count
+                rows = build_comparison_rows(response, [r.name for r in date_ranges], truncated)
+                logger.info(f"Aligned {len(response.rows)} rows into {len(rows)} comparison rows")
+                
+                result = {
+                    "success": True,
+                    "comparison": True,
+                    "data": rows,
+                    "rowCount": len(rows),
+                    "ga4RowCount": response.row_count,
+                    "truncated": truncated,
+                    "dimensions": input.dimensions,
+                    "metrics": input.metrics,
+                    "dateRanges": {r.name: f"{r.start_date} to {r.end_date}" for r in date_ranges},
+                    "baseDateRange": date_ranges[0].name,
+                    "propertyId": property_id
+                }
+                if truncated:
+                    logger.warning(f"Comparison truncated: {len(response.rows)} of {response.row_count} rows returned")
+                    result["warning"] = (
+                        f"Only {len(response.rows)} of {response.row_count} rows were returned because of limit; "
+                        "deltas are None where a date range may have been cut off. Increase limit or add filters."
+                    )
+                return result
+            
             rows = []
             total_sessions = 0  # Track total for aggregation
             
@@ -238,14 +377,19 @@ async def get_ga4_data(input: GA4QueryInput) -> dict:
             
             logger.info(f"Successfully processed {len(rows)} rows, total sessions: {total_sessions}")
             
+            # Only complete results can be rolled up; truncated ones would undercount
+            if len(response.rows) >= response.row_count:
+                remember_result(cache_key, dimension_names, input.metrics, rows)
+            
             return {
                 "success": True,
+                "servedLocally": False,
                 "data": rows,
                 "rowCount": len(rows),
                 "totalSessions": total_sessions,  # Add total for verification
                 "dimensions": input.dimensions,
                 "metrics": input.metrics,
-                "dateRange": f"{input.start_date} to {input.end_date}",
+                "dateRange": f"{date_ranges[0].start_date} to {date_ranges[0].end_date}",
                 "propertyId": property_id
             }
         except Exception as e:
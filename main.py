@@ -42,11 +42,32 @@ async def query_ga4_data(input: GA4QueryInput) -> dict:
     - For daily sessions: dimensions=["date"], metrics=["sessions"]
     - For traffic by country: dimensions=["country"], metrics=["users", "sessions"]
     - For page performance: dimensions=["pagePath"], metrics=["pageviews", "users"]
+    
+    Period-over-period comparison (one call instead of several):
+    - Pass up to 4 date_ranges instead of start_date/end_date, each with a name and
+      either a preset from get_common_date_ranges or explicit start_date/end_date
+    - For this month vs last month by country: dimensions=["country"], metrics=["sessions"],
+      date_ranges=[{"name": "current", "preset": "this_month"}, {"name": "previous", "preset": "last_month"}]
+    - Rows are aligned by dimensions with per-range values and absolute/percentage
+      deltas of the first range against each other range
+    
+    Roll-ups of a recent result (same user, property, dates and filters) are answered locally:
+    - After dimensions=["country", "deviceCategory"] with daily granularity, asking for
+      dimensions=["country"], granularity="weekly"/"monthly", or a per-country total over the
+      whole range (granularity=None) is aggregated without a GA4 call
+    - Only additive metrics (sessions, screenPageViews, eventCount, totalRevenue, ...) are rolled up,
+      and only over session-scoped dimensions (country, deviceCategory, sessionSource, ...);
+      user counts, rates and page/event/item dimensions are always fetched from GA4
+    - Sessions summed from daily rows are approximate: a session crossing midnight counts once per day
+    - The response field servedLocally tells whether GA4 was called
     """
     try:
         logger.info(f"Querying GA4 data for user: {input.user_id}")
         logger.info(f"Dimensions: {input.dimensions}, Metrics: {input.metrics}")
-        logger.info(f"Date range: {input.start_date} to {input.end_date}")
+        if input.date_ranges:
+            logger.info(f"Date ranges: {[r.name for r in input.date_ranges]}")
+        else:
+            logger.info(f"Date range: {input.start_date} to {input.end_date}")
         
         result = await get_ga4_data(input)
         
@@ -3,12 +3,71 @@ from typing import Optional, List
 from datetime import datetime
 import re
 
+MAX_DATE_RANGES = 4
+
+# Calendar dimensions whose values differ between date ranges, so comparison rows would
+# never align. Range-relative ones (nthDay, nthWeek, ...) and dayOfWeek/hour still work.
+CALENDAR_DIMENSIONS = {
+    "date", "dateHour", "dateHourMinute", "day", "week", "month", "year",
+    "yearMonth", "yearWeek", "isoWeek", "isoYear", "isoYearIsoWeek",
+}
+
+def validate_date_string(v: str) -> str:
+    """Validate date format is YYYY-MM-DD"""
+    if not re.match(r'^\d{4}-\d{2}-\d{2}$', v):
+        raise ValueError('Date must be in YYYY-MM-DD format')
+    
+    # Try to parse the date to ensure it's valid
+    try:
+        datetime.strptime(v, '%Y-%m-%d')
+    except ValueError:
+        raise ValueError('Invalid date')
+    
+    return v
+
+class NamedDateRange(BaseModel):
+    name: str = Field(..., description="Label for this date range in the response (e.g., 'this_month')")
+    preset: Optional[str] = Field(default=None, description="Key from get_common_date_ranges (e.g., 'last_month', 'last_7_days')")
+    start_date: Optional[str] = Field(default=None, description="Start date in YYYY-MM-DD format, used when no preset is given")
+    end_date: Optional[str] = Field(default=None, description="End date in YYYY-MM-DD format, used when no preset is given")
+
+    @validator('name')
+    def validate_name(cls, v):
+        """Ensure name is not empty"""
+        if not v or not v.strip():
+            raise ValueError('Date range name cannot be empty')
+        # GA4 rejects names with these reserved prefixes
+        if v.strip().startswith(('date_range_', 'RESERVED_')):
+            raise ValueError("Date range name cannot start with 'date_range_' or 'RESERVED_'")
+        return v.strip()
+
+    @validator('start_date', 'end_date')
+    def validate_date_format(cls, v):
+        """Validate date format is YYYY-MM-DD"""
+        if v is None:
+            return v
+        return validate_date_string(v)
+
+    @validator('end_date', always=True)
+    def validate_date_source(cls, v, values):
+        """Ensure exactly one of preset or start_date/end_date is given"""
+        # An invalid start_date has already been reported
+        if 'start_date' not in values:
+            return v
+        has_explicit_dates = values['start_date'] is not None or v is not None
+        if values.get('preset'):
+            if has_explicit_dates:
+                raise ValueError('Use either preset or start_date/end_date, not both')
+        elif values['start_date'] is None or v is None:
+            raise ValueError('Either preset or both start_date and end_date must be provided')
+        return v
+
 class GA4QueryInput(BaseModel):
     user_id: str = Field(..., description="User ID to identify whose GA4 tokens to use")
     dimensions: List[str] = Field(default=[], description="GA4 dimension names (e.g., ['date', 'country', 'pagePath'])")
     metrics: List[str] = Field(..., description="GA4 metric names (e.g., ['sessions', 'pageviews', 'users'])")
-    start_date: str = Field(..., description="Start date in YYYY-MM-DD format (e.g., '2025-06-09')")
-    end_date: str = Field(..., description="End date in YYYY-MM-DD format (e.g., '2025-07-08')")
+    start_date: Optional[str] = Field(default=None, description="Start date in YYYY-MM-DD format (e.g., '2025-06-09'), required unless date_ranges is set")
+    end_date: Optional[str] = Field(default=None, description="End date in YYYY-MM-DD format (e.g., '2025-07-08'), required unless date_ranges is set")
     limit: Optional[int] = Field(default=10000, description="Maximum number of rows to return (default: 100)")
     property_id: Optional[str] = Field(default=None, description="Override GA4 property ID if needed")
     
@@ -17,19 +76,38 @@ class GA4QueryInput(BaseModel):
     currency_code: Optional[str] = Field(default=None, description="Currency code for monetary metrics (e.g., 'USD')")
     granularity: Optional[str] = Field(default="daily", description="Granularity for date-based queries (e.g., 'daily', 'weekly', 'monthly')")
     include_empty_rows: Optional[bool] = Field(default=False, description="Whether to include rows with zero values")
+    date_ranges: Optional[List[NamedDateRange]] = Field(default=None, description=f"Up to {MAX_DATE_RANGES} named date ranges to compare in one query; the first one is compared against the others")
 
     @validator('start_date', 'end_date')
     def validate_date_format(cls, v):
         """Validate date format is YYYY-MM-DD"""
-        if not re.match(r'^\d{4}-\d{2}-\d{2}$', v):
-            raise ValueError('Date must be in YYYY-MM-DD format')
-        
-        # Try to parse the date to ensure it's valid
-        try:
-            datetime.strptime(v, '%Y-%m-%d')
-        except ValueError:
-            raise ValueError('Invalid date')
-        
+        if v is None:
+            return v
+        return validate_date_string(v)
+
+    @validator('date_ranges', always=True)
+    def validate_date_ranges(cls, v, values):
+        """Ensure exactly one way of giving dates is used, within GA4 limits and uniquely named"""
+        has_explicit_dates = values.get('start_date') is not None or values.get('end_date') is not None
+        if v is None:
+            if values.get('start_date') is None or values.get('end_date') is None:
+                raise ValueError('start_date and end_date are required unless date_ranges is set')
+            return v
+        if has_explicit_dates:
+            raise ValueError('Use either date_ranges or start_date/end_date, not both')
+        if not v:
+            raise ValueError('date_ranges cannot be empty')
+        if len(v) > MAX_DATE_RANGES:
+            raise ValueError(f'At most {MAX_DATE_RANGES} date ranges can be compared')
+        names = [r.name for r in v]
+        if len(set(names)) != len(names):
+            raise ValueError('Date range names must be unique')
+        calendar_dimensions = [d for d in values.get('dimensions', []) if d in CALENDAR_DIMENSIONS]
+        if len(v) > 1 and calendar_dimensions:
+            raise ValueError(
+                f"Dimensions {calendar_dimensions} cannot be compared across date ranges; "
+                "use range-relative dimensions such as nthDay or nthWeek instead"
+            )
         return v
 
     @validator('metrics')
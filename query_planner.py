@@ -0,0 +1,222 @@
+from datetime import datetime
+from utils import parse_metric_value
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# How long a fetched result can be reused, and how many results and rows in total are
+# kept in memory across all users of the process
+RESULT_CACHE_TTL_SECONDS = 300
+RESULT_CACHE_MAX_ENTRIES = 128
+RESULT_CACHE_MAX_ROWS = 50000
+
+# Metrics that can be summed across the dimensions in ROLLUP_SAFE_DIMENSIONS.
+# User counts and ratios (activeUsers, bounceRate, ...) are deduplicated or averaged by GA4
+# and can only be served from an identical earlier query.
+ADDITIVE_METRICS = {
+    "sessions",
+    "engagedSessions",
+    "screenPageViews",
+    "eventCount",
+    "conversions",
+    "keyEvents",
+    "transactions",
+    "ecommercePurchases",
+    "totalRevenue",
+    "purchaseRevenue",
+    "itemRevenue",
+    "itemsPurchased",
+    "addToCarts",
+    "checkouts",
+    "adRevenue",
+    "publisherAdClicks",
+    "publisherAdImpressions",
+    "userEngagementDuration",
+}
+
+# Session- and user-scoped dimensions: every session has exactly one value, so dropping
+# them and summing never counts a session twice. Hit-, event- and item-scoped dimensions
+# (pagePath, eventName, itemName, ...) are not listed and always go to GA4.
+ROLLUP_SAFE_DIMENSIONS = {
+    "country",
+    "region",
+    "city",
+    "continent",
+    "subContinent",
+    "deviceCategory",
+    "operatingSystem",
+    "browser",
+    "platform",
+    "language",
+    "newVsReturning",
+    "sessionSource",
+    "sessionMedium",
+    "sessionSourceMedium",
+    "sessionCampaignName",
+    "sessionDefaultChannelGroup",
+    "firstUserSource",
+    "firstUserMedium",
+    "firstUserSourceMedium",
+    "firstUserDefaultChannelGroup",
+}
+
+# Coarser time dimensions that can be derived from a daily "date" (YYYYMMDD) value.
+# "date" can also be dropped entirely for a total over the whole range. Either way the
+# result is approximate for sessions and engagedSessions: GA4 counts a session that
+# crosses midnight once per day, so summing daily rows counts it more than once.
+DATE_ROLLUPS = {"week", "month"}
+
+_result_cache: list[dict] = []
+
+def _ga4_week(day: datetime) -> str:
+    """
+    GA4 "week": weeks start on Sunday and January 1st is always in week 01
+    """
+    jan_first_is_sunday = day.replace(month=1, day=1).weekday() == 6
+    week = int(day.strftime("%U")) + (0 if jan_first_is_sunday else 1)
+    return f"{week:02d}"
+
+def _derive_dimension(name: str, row: dict) -> str:
+    """
+    Get a requested dimension value from a cached row, deriving week/month from date
+    """
+    if name in row:
+        return row[name]
+    day = datetime.strptime(row["date"], "%Y%m%d")
+    if name == "week":
+        return _ga4_week(day)
+    return day.strftime("%m")
+
+def _format_metric(value: float | int) -> str:
+    """
+    Format a summed metric the way GA4 returns metric values (as strings)
+    """
+    if isinstance(value, float):
+        # Drop float noise from summing, e.g. ten "0.1" rows -> 1.0000000000000002
+        value = round(value, 10)
+        if value.is_integer():
+            value = int(value)
+    return str(value)
+
+def build_cache_key(user_id: str, property_id: str, date_ranges: list[tuple[str, str]], filters: dict | None,
+                    currency_code: str | None, include_empty_rows: bool | None) -> str:
+    """
+    Key identifying results that only differ by dimensions, metrics, order and limit
+    """
+    return json.dumps({
+        "user": user_id,
+        "property": property_id,
+        "dateRanges": date_ranges,
+        "filters": filters,
+        "currency": currency_code,
+        "emptyRows": bool(include_empty_rows),
+    }, sort_keys=True)
+
+def _prune_cache() -> None:
+    """Drop expired results and keep the cache within its size limits, oldest first."""
+    now = time.monotonic()
+    _result_cache[:] = [e for e in _result_cache if now - e["storedAt"] < RESULT_CACHE_TTL_SECONDS]
+    del _result_cache[:-RESULT_CACHE_MAX_ENTRIES]
+
+    total_rows = sum(len(e["rows"]) for e in _result_cache)
+    while total_rows > RESULT_CACHE_MAX_ROWS:
+        total_rows -= len(_result_cache.pop(0)["rows"])
+
+def remember_result(cache_key: str, dimensions: list[str], metrics: list[str], rows: list[dict]) -> None:
+    """
+    Store a complete (not truncated by limit) GA4 result for later roll-ups.
+
+    Rows are copied so callers can modify the returned data without touching the cache.
+    """
+    if len(rows) > RESULT_CACHE_MAX_ROWS:
+        return
+
+    _result_cache.append({
+        "key": cache_key,
+        "dimensions": list(dimensions),
+        "metrics": list(metrics),
+        "rows": [dict(row) for row in rows],
+        "storedAt": time.monotonic(),
+    })
+    _prune_cache()
+
+def _can_serve(entry: dict, dimensions: list[str], metrics: list[str]) -> bool:
+    """
+    Check whether a cached result contains everything needed for the requested report
+    """
+    if not set(metrics) <= set(entry["metrics"]):
+        return False
+
+    # Identical grain: no aggregation needed, so any metric can be reused
+    if set(dimensions) == set(entry["dimensions"]):
+        return True
+
+    if not all(m in ADDITIVE_METRICS for m in metrics):
+        return False
+
+    for d in dimensions:
+        if d in entry["dimensions"]:
+            continue
+        if d in DATE_ROLLUPS and "date" in entry["dimensions"]:
+            continue
+        return False
+
+    # Every dimension being aggregated away must be safe to sum over (see DATE_ROLLUPS for date)
+    for d in set(entry["dimensions"]) - set(dimensions):
+        if d != "date" and d not in ROLLUP_SAFE_DIMENSIONS:
+            return False
+    return True
+
+def _sort_rows(rows: list[dict], order_by: list[dict] | None) -> list[dict]:
+    """
+    Apply GA4-style order_by clauses locally
+    """
+    # Stable sorts applied from the last clause to the first give multi-key ordering
+    for order in reversed(order_by or []):
+        desc = order.get("desc", False)
+        if "metric" in order:
+            name = order["metric"]["metric_name"]
+            rows.sort(key=lambda r: parse_metric_value(r.get(name)), reverse=desc)
+        elif "dimension" in order:
+            name = order["dimension"]["dimension_name"]
+            rows.sort(key=lambda r: r.get(name, ""), reverse=desc)
+    return rows
+
+def plan_rollup(cache_key: str, dimensions: list[str], metrics: list[str],
+                order_by: list[dict] | None = None, limit: int | None = None) -> dict | None:
+    """
+    Try to answer a query by aggregating an already-fetched finer-grained result.
+
+    Returns {"rows": [...], "sourceDimensions": [...]} when the query can be served
+    locally, or None when it has to be sent to GA4.
+    """
+    _prune_cache()
+
+    # Prefer the most recent matching result
+    for entry in reversed(_result_cache):
+        if entry["key"] != cache_key or not _can_serve(entry, dimensions, metrics):
+            continue
+
+        aggregated = {}
+        for row in entry["rows"]:
+            group = tuple(_derive_dimension(d, row) for d in dimensions)
+            totals = aggregated.setdefault(group, {m: 0 for m in metrics})
+            for m in metrics:
+                totals[m] += parse_metric_value(row.get(m))
+
+        rows = []
+        for group, totals in aggregated.items():
+            row_data = dict(zip(dimensions, group))
+            row_data.update({m: _format_metric(v) for m, v in totals.items()})
+            rows.append(row_data)
+
+        rows = _sort_rows(rows, order_by)
+        if limit:
+            rows = rows[:limit]
+
+        logger.info(f"Serving {dimensions} locally from cached result with dimensions {entry['dimensions']}")
+        return {"rows": rows, "sourceDimensions": entry["dimensions"]}
+
+    return None
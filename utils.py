@@ -48,4 +48,34 @@ def get_date_suggestions() -> dict:
         "success": True,
         "dateRanges": suggestions,
         "currentDate": today.strftime("%Y-%m-%d")
-    }
\ No newline at end of file
+    }
+
+def resolve_date_range(preset: str | None = None, start_date: str | None = None, end_date: str | None = None) -> tuple[str, str]:
+    """
+    Resolve a date range to explicit (start_date, end_date) strings.
+
+    A preset must be one of the keys returned by get_date_suggestions();
+    otherwise both start_date and end_date must be given.
+    """
+    if preset:
+        suggestions = get_date_suggestions()["dateRanges"]
+        if preset not in suggestions:
+            raise ValueError(f"Unknown date range preset '{preset}'. Available presets: {', '.join(suggestions)}")
+        return suggestions[preset]["start_date"], suggestions[preset]["end_date"]
+
+    if not start_date or not end_date:
+        raise ValueError("Either a preset or both start_date and end_date must be provided")
+
+    return start_date, end_date
+
+
+def parse_metric_value(value) -> float | int:
+    """
+    Convert a GA4 metric value string to a number, treating missing values as 0
+    """
+    if value is None:
+        return 0
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return float(value)